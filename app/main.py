@@ -1,27 +1,38 @@
-import io
+import os
+import asyncio
+import hashlib
+import html
+import queue
+import threading
 import zipfile
-from pathlib import Path
+from concurrent.futures import Future
+from pathlib import Path, PurePosixPath
 from datetime import datetime
-from typing import Optional, Dict, List
+from typing import Optional, Dict, List, Tuple, Any
 import re
+import numpy as np
 import pandas as pd
 from fastapi import FastAPI, Request, UploadFile, File
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, FileResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 
-from .ocr_extractor import run_ocr, _get_ocr  # warmup
-from . import parsers
+from . import ocr_pool, parsers
+from .ocr_extractor import ocr_cache_tag, dump_json_bytes, load_json_bytes
 
 BASE_DIR = Path(__file__).resolve().parent.parent
 TEMPLATES_DIR = BASE_DIR / "app" / "templates"
 STATIC_DIR = BASE_DIR / "app" / "static"
 OUTPUTS_DIR = BASE_DIR / "outputs"
 DATA_DIR = BASE_DIR / "data"
+# NOTE: no size bound or cleanup; entries are small JSON line lists, delete the
+# directory to reclaim space (stale engine/prep tags are never read again)
+OCR_CACHE_DIR = DATA_DIR / "ocr_cache"
 
 app = FastAPI(title="KHIND Receipt OCR")
 app.mount("/static", StaticFiles(directory=STATIC_DIR), name="static")
-app.mount("/outputs", StaticFiles(directory=OUTPUTS_DIR), name="outputs")
+# outputs/ is created by the first run; importing the app has no filesystem side effects
+app.mount("/outputs", StaticFiles(directory=OUTPUTS_DIR, check_dir=False), name="outputs")
 templates = Jinja2Templates(directory=TEMPLATES_DIR)
 
 SUPPORTED_EXT = [".jpg", ".jpeg", ".png"]
@@ -29,20 +40,100 @@ SUPPORTED_EXT = [".jpg", ".jpeg", ".png"]
 # Toggle heavy debug dumps (JSON/TXT) to speed up
 DEBUG_DUMP_MAX = 3  # dump only for first N rows; set 0 to disable
 
-def _save_zip_to_dir(zf: UploadFile, dest: Path):
-    dest.mkdir(parents=True, exist_ok=True)
-    data = zf.file.read()
-    with zipfile.ZipFile(io.BytesIO(data)) as z:
-        z.extractall(dest)
-
-def _scan_images(images_dir: Path, supported_ext: List[str]) -> List[Path]:
-    images: List[Path] = []
-    for p in images_dir.rglob("*"):
-        if p.is_file() and p.suffix.lower() in supported_ext:
-            images.append(p)
-    # filename sort is fine when names are MLP_XXXX
-    images.sort(key=lambda x: x.name.lower())
-    return images
+OUTPUT_COLS = [
+    "Amount spent", "Validity", "Reason for invalid",
+    "Product purchased 1", "Amount purchased 1",
+    "Product purchased 2", "Amount purchased 2",
+    "Product purchased 3", "Amount purchased 3",
+    "Store", "Store Location"
+]
+
+# Bounded so extraction never runs far ahead of OCR (keeps pipeline latency/RAM bounded)
+PIPELINE_QUEUE_MAX = 32
+
+# Copy chunk for zip members (receipt photos are a few MB each)
+ZIP_COPY_BUFSIZE = 1 << 20
+
+def _open_zip(zf: UploadFile) -> zipfile.ZipFile:
+    # read straight from the spooled upload; no second in-memory copy of the archive
+    zf.file.seek(0)
+    return zipfile.ZipFile(zf.file)
+
+def _member_dest(dest: Path, name: str) -> Optional[Path]:
+    # same sanitising as ZipFile.extractall: drop absolute/'..' components
+    parts = [p for p in PurePosixPath(name.replace("\\", "/")).parts if p not in ("/", ".", "..")]
+    return dest.joinpath(*parts) if parts else None
+
+def _extract_member(z: zipfile.ZipFile, info: zipfile.ZipInfo, target: Path) -> str:
+    """
+    Copy one member to disk in ZIP_COPY_BUFSIZE chunks.
+    Returns the SHA-256 of its bytes (hashed on the way through; OCR cache key).
+    """
+    target.parent.mkdir(parents=True, exist_ok=True)
+    h = hashlib.sha256()
+    with z.open(info) as src, open(target, "wb") as dst:
+        while True:
+            buf = src.read(ZIP_COPY_BUFSIZE)
+            if not buf:
+                break
+            h.update(buf)
+            dst.write(buf)
+    return h.hexdigest()
+
+def _ocr_cache_key() -> Optional[str]:
+    """
+    Prep settings + OCR engine (versions, effective PaddleOCR kwargs), asked for
+    once per batch. None when the engine can't be identified: the batch then
+    runs without the cache.
+    """
+    try:
+        return f"{ocr_cache_tag()}_{ocr_pool.engine_tag()}"
+    except Exception as e:
+        print("[WARN] OCR cache disabled for this batch:", e)
+        return None
+
+def _ocr_cache_path(digest: str, key: str) -> Path:
+    return OCR_CACHE_DIR / f"{digest}_{key}.json"
+
+def _load_ocr_cache(digest: str, key: str) -> Optional[List[str]]:
+    try:
+        lines = load_json_bytes(_ocr_cache_path(digest, key).read_bytes())
+    except Exception:
+        return None
+    # anything but a list of str is treated as a miss (and rewritten after OCR)
+    if isinstance(lines, list) and all(isinstance(ln, str) for ln in lines):
+        return lines
+    return None
+
+def _store_ocr_cache(digest: str, key: str, lines: List[str]):
+    try:
+        path = _ocr_cache_path(digest, key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        tmp.write_bytes(dump_json_bytes(lines))
+        os.replace(tmp, path)  # atomic: concurrent readers never see a partial file
+    except Exception as e:
+        print("[WARN] OCR cache write failed:", e)
+
+_DIGIT_RUN_RE = re.compile(r"(\d+)")
+
+def _natural_key(name: str) -> list:
+    """MLP_2 < MLP_10 (plain string sort puts 10 first)."""
+    return [int(t) if t.isdigit() else t.lower() for t in _DIGIT_RUN_RE.split(name)]
+
+def _scan_images(z: zipfile.ZipFile, dest: Path, supported_ext: List[str]) -> Dict[Path, zipfile.ZipInfo]:
+    """
+    List image members as their (future) paths under dest, without extracting.
+    The pipeline extracts each one only when its row is about to be OCR'd.
+    """
+    members: Dict[Path, zipfile.ZipInfo] = {}
+    for info in z.infolist():
+        if info.is_dir():
+            continue
+        p = _member_dest(dest, info.filename)
+        if p is not None and p.suffix.lower() in supported_ext:
+            members[p] = info
+    return dict(sorted(members.items(), key=lambda kv: _natural_key(kv[0].name)))
 
 _RE_MLP = re.compile(r"(mlp)[_\-\s]*0*(\d+)", re.I)
 
@@ -56,26 +147,255 @@ def _normalize_id(s: str) -> str:
 def _normalize_stem_from_path(p: Path) -> str:
     return _normalize_id(p.stem)
 
+def _read_raw_csv(f) -> pd.DataFrame:
+    """
+    Every column is read as text: participant columns are passed through to the
+    output as-is (no date/offset parsing, no "007" -> 7).
+    """
+    return pd.read_csv(f, dtype=str)
+
+def _str_col(s: pd.Series) -> np.ndarray:
+    """Column as strings, missing cells as "nan" (what str() gave per row)."""
+    return s.to_numpy(dtype=object, na_value=np.nan).astype(str)
+
+_XLSX_MEDIA_TYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+_RE_OUTPUT_STEM = re.compile(r"processed_\d{8}_\d{6}")
+_xlsx_lock = threading.Lock()
+
+def _write_xlsx(df: pd.DataFrame, xlsx_path: Path):
+    """
+    Written under a temp name and renamed, so a finished file is never partial.
+    """
+    tmp = xlsx_path.with_name(f".{xlsx_path.name}.tmp")
+    try:
+        # NOTE: no xlsxwriter constant_memory: pandas writes cells column by column,
+        # which that mode (row-at-a-time flushing) silently truncates
+        with pd.ExcelWriter(tmp, engine="xlsxwriter") as writer:
+            df.to_excel(writer, index=False, sheet_name="Processed")
+        os.replace(tmp, xlsx_path)
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
+
+def _xlsx_from_csv(csv_path: Path, xlsx_path: Path):
+    """
+    Build the XLSX from the processed CSV. Participant columns stay text (as
+    uploaded); only the product quantities go back to numbers.
+    """
+    df = pd.read_csv(csv_path, dtype=str)
+    for c in ("Amount purchased 1", "Amount purchased 2", "Amount purchased 3"):
+        if c in df.columns:
+            df[c] = pd.to_numeric(df[c])
+    _write_xlsx(df, xlsx_path)
+
+# (submission_no, fb_city, fb_state, image_path, debug_path)
+_Job = Tuple[str, Optional[str], Optional[str], Optional[Path], Optional[Path]]
+
+def _parse_row(row_idx: int, job: _Job, res: Any) -> Tuple[Any, ...]:
+    submission_no, fb_city, fb_state, image_path, _ = job
+
+    ocr_error = False
+    image_missing = image_path is None
+    lines: List[str] = []
+    if isinstance(res, BaseException):
+        ocr_error = True
+        print(f"[OCR ERROR] row {row_idx+2} ({submission_no}) @ {image_path}: {res}")
+    elif res is not None:
+        lines = res
+
+    # --- Parse ---
+    # Uppercase each line once; KHIND rows feed both the amount and the products
+    ups = [ln.upper() for ln in lines]
+    khind_rows = parsers.find_khind_rows(lines, ups)
+    amount_spent = parsers.extract_amount_spent(lines, khind_rows=khind_rows, ups=ups) if lines else None
+    # store line matched once; name and location both start from it
+    store_match = parsers.find_known_store(lines, ups) if lines else None
+    store = parsers.extract_store_name(lines, ups=ups, store_match=store_match) if lines else None
+    # NOTE: extract_store_location ignores participant fallback by design (your latest parser)
+    store_loc = parsers.extract_store_location(lines, fb_city, fb_state, ups=ups, store_match=store_match) if lines else None
+    products = parsers.extract_products(lines, max_items=3, khind_rows=khind_rows, ups=ups) if lines else []
+
+    # --- Validity ---
+    if image_missing:
+        validity, reason = "INVALID", "Image missing"
+    elif ocr_error:
+        validity, reason = "INVALID", "OCR failed"
+    else:
+        validity, reason = parsers.decide_validity(amount_spent, products, image_missing=False)
+
+    # --- Row values (OUTPUT_COLS order) ---
+    return (
+        amount_spent or "",
+        validity,
+        reason,
+        products[0][0] if len(products) >= 1 else "",
+        products[0][1] if len(products) >= 1 else "",
+        products[1][0] if len(products) >= 2 else "",
+        products[1][1] if len(products) >= 2 else "",
+        products[2][0] if len(products) >= 3 else "",
+        products[2][1] if len(products) >= 3 else "",
+        store or "",
+        store_loc or "",
+    )
+
+def _run_pipeline(z: zipfile.ZipFile, members: Dict[Path, zipfile.ZipInfo], jobs: List[_Job]) -> Dict[str, np.ndarray]:
+    """
+    Three stages connected by bounded queues, so wall time tracks the slowest
+    stage (OCR) instead of the sum:
+      A) extract each row's image out of the zip (row order), hashing it
+      B) ocr_pool.concurrency() threads, each driving one call in the OCR worker pool
+         (skipped on an OCR cache hit for the same image bytes)
+      C) parse (this thread), writing each row into preallocated column arrays
+    """
+    n_workers = ocr_pool.concurrency()
+    cache_key = _ocr_cache_key()
+    ocr_q: "queue.Queue[Optional[Tuple[int, Any]]]" = queue.Queue(maxsize=PIPELINE_QUEUE_MAX)
+    parse_q: "queue.Queue[Optional[Tuple[int, Any]]]" = queue.Queue(maxsize=PIPELINE_QUEUE_MAX)
+    abort = threading.Event()
+    # identical images in one batch share a single OCR call
+    inflight: Dict[str, "Future[List[str]]"] = {}
+    inflight_lock = threading.Lock()
+    stage_errors: List[BaseException] = []
+
+    def extract_stage():
+        try:
+            for row_idx, (_, _, _, image_path, _) in enumerate(jobs):
+                if abort.is_set():
+                    break
+                res: Any = None  # sha256 digest, or the extraction error
+                if image_path is not None:
+                    try:
+                        res = _extract_member(z, members[image_path], image_path)
+                    except Exception as e:
+                        res = e
+                ocr_q.put((row_idx, res))
+        finally:
+            for _ in range(n_workers):
+                ocr_q.put(None)
+
+    def ocr_one(image_path: Path, dbg_path: Optional[Path], digest: str) -> List[str]:
+        if dbg_path is not None:
+            # debug rows always run OCR so their dumps get written
+            lines = ocr_pool.submit(image_path, dbg_path).result()
+            if cache_key is not None:
+                _store_ocr_cache(digest, cache_key, lines)
+            return lines
+        if cache_key is not None:
+            cached = _load_ocr_cache(digest, cache_key)
+            if cached is not None:
+                return cached
+        with inflight_lock:
+            fut = inflight.get(digest)
+            owner = fut is None
+            if owner:
+                # an owner may have finished (cached, then left inflight) since our first look
+                cached = _load_ocr_cache(digest, cache_key) if cache_key is not None else None
+                if cached is not None:
+                    return cached
+                fut = inflight[digest] = ocr_pool.submit(image_path)
+        if not owner:
+            return fut.result()
+        try:
+            lines = fut.result()
+            if cache_key is not None:
+                _store_ocr_cache(digest, cache_key, lines)
+        finally:
+            # later duplicates read the disk cache; don't pin every result until the batch ends
+            # (without a cache the finished future stays in inflight for them instead)
+            if cache_key is not None:
+                with inflight_lock:
+                    inflight.pop(digest, None)
+        return lines
+
+    def ocr_stage():
+        try:
+            while True:
+                item = ocr_q.get()
+                if item is None:
+                    return
+                row_idx, res = item
+                _, _, _, image_path, dbg_path = jobs[row_idx]
+                if isinstance(res, str) and not abort.is_set():
+                    try:
+                        res = ocr_one(image_path, dbg_path, res)
+                    except Exception as e:
+                        res = e
+                elif isinstance(res, str):
+                    res = None
+                parse_q.put((row_idx, res))
+        except BaseException as e:
+            # a row this thread held would never reach stage C: fail the batch
+            stage_errors.append(e)
+            abort.set()
+        finally:
+            parse_q.put(None)  # stage C counts one sentinel per thread, whatever happened
+
+    extractor = threading.Thread(target=extract_stage, name="zip-extract", daemon=True)
+    threads = [extractor]
+    threads += [threading.Thread(target=ocr_stage, name=f"ocr-{i}", daemon=True) for i in range(n_workers)]
+    for t in threads:
+        t.start()
+
+    def drain_extract():
+        # stage B may be gone: keep ocr_q moving until stage A has stopped reading the zip
+        while extractor.is_alive():
+            try:
+                ocr_q.get(timeout=0.05)
+            except queue.Empty:
+                pass
+
+    cols = {c: np.empty(len(jobs), dtype=object) for c in OUTPUT_COLS}
+    col_arrs = [cols[c] for c in OUTPUT_COLS]
+    finished = 0
+    try:
+        while finished < n_workers:
+            item = parse_q.get()
+            if item is None:
+                finished += 1
+                continue
+            row_idx, res = item
+            item = None  # drop this row's OCR lines now, not when the next row arrives
+            for arr, val in zip(col_arrs, _parse_row(row_idx, jobs[row_idx], res)):
+                arr[row_idx] = val
+            res = None
+    except BaseException:
+        # let stages A/B wind down instead of blocking on full queues
+        abort.set()
+        while finished < n_workers:
+            if parse_q.get() is None:
+                finished += 1
+        drain_extract()
+        raise
+    if stage_errors:
+        drain_extract()
+        raise stage_errors[0]
+    return cols
+
+@app.on_event("startup")
+def _warm_ocr_pool():
+    # spawn OCR workers (and fetch the model once) before the first upload arrives
+    ocr_pool.warmup()
+
 @app.get("/", response_class=HTMLResponse)
 def index(request: Request):
     return templates.TemplateResponse("index.html", {"request": request})
 
-@app.post("/process", response_class=HTMLResponse)
-def process(request: Request, raw_csv: UploadFile = File(...), images_zip: UploadFile = File(...)):
-    # Save images zip
-    ts = datetime.now().strftime("%Y%m%d_%H%M%S")
+def _process_batch(csv_file, zip_upload: UploadFile, ts: str) -> Optional[Tuple[pd.DataFrame, Path, List[Dict[str, Any]]]]:
+    """
+    Everything /process does that blocks: zip scan, CSV read, row -> image
+    mapping, the pipeline, the CSV output and the preview rows. Runs in the executor so the
+    event loop keeps serving other requests meanwhile.
+    Returns None when the CSV has no 'Submission No' column.
+    """
+    # Open images zip (members are streamed out by the pipeline)
     run_dir = DATA_DIR / f"run_{ts}"
     img_dir = run_dir / "images"
-    _save_zip_to_dir(images_zip, img_dir)
-
-    # Pre-warm the OCR once (this also triggers model download only once)
-    try:
-        _get_ocr()
-    except Exception as e:
-        print("[WARN] OCR warmup failed:", e)
+    img_dir.mkdir(parents=True, exist_ok=True)
+    z = _open_zip(zip_upload)
 
     # Build ordered image list
-    images_list = _scan_images(img_dir, SUPPORTED_EXT)
+    members = _scan_images(z, img_dir, SUPPORTED_EXT)
+    images_list = list(members)
     print(f"[IMAGES] Found {len(images_list)} images in {img_dir}")
     if images_list:
         print("[IMAGES] First few:", [p.name for p in images_list[:5]])
@@ -84,31 +404,18 @@ def process(request: Request, raw_csv: UploadFile = File(...), images_zip: Uploa
     img_by_norm: Dict[str, Path] = { _normalize_stem_from_path(p): p for p in images_list }
 
     # Load CSV
-    df_raw = pd.read_csv(raw_csv.file)
+    df_raw = _read_raw_csv(csv_file)
     if "Submission No" not in df_raw.columns:
-        return HTMLResponse("<h3>CSV missing 'Submission No' column.</h3>", status_code=400)
+        z.close()
+        return None
 
     # Optional: if you have thousands of rows but only 200 images, bound the loop
     n_rows = len(df_raw)
 
     # Detect fallback city/state columns (not used for location anymore in parsers)
-    fallback_city_col: Optional[str] = None
-    fallback_state_col: Optional[str] = None
-    for c in df_raw.columns:
-        cl = c.strip().lower()
-        if cl == "city":
-            fallback_city_col = c
-        elif cl == "state":
-            fallback_state_col = c
-
-    new_cols = [
-        "Amount spent", "Validity", "Reason for invalid",
-        "Product purchased 1", "Amount purchased 1",
-        "Product purchased 2", "Amount purchased 2",
-        "Product purchased 3", "Amount purchased 3",
-        "Store", "Store Location"
-    ]
-    extracted_rows: List[dict] = []
+    col_map = {c.strip().lower(): c for c in df_raw.columns}
+    fallback_city_col: Optional[str] = col_map.get("city")
+    fallback_state_col: Optional[str] = col_map.get("state")
 
     used_images: set[Path] = set()
 
@@ -149,86 +456,78 @@ def process(request: Request, raw_csv: UploadFile = File(...), images_zip: Uploa
         print(f"[MAP] row {row_idx+2} ({submission_no}) -> None [NO IMAGE LEFT]")
         return None
 
-    # Process rows
-    for row_idx, row in df_raw.iterrows():
-        submission_no = str(row.get("Submission No", ""))
-        fb_city = str(row.get(fallback_city_col, "")) if fallback_city_col else None
-        fb_state = str(row.get(fallback_state_col, "")) if fallback_state_col else None
+    # Map rows -> images first (sequential: mapping depends on used_images)
+    # (plain column arrays: no per-row Series boxing like iterrows)
+    sub_arr = _str_col(df_raw["Submission No"])
+    city_arr = _str_col(df_raw[fallback_city_col]) if fallback_city_col else None
+    state_arr = _str_col(df_raw[fallback_state_col]) if fallback_state_col else None
+    jobs: List[_Job] = []
+    for row_idx, submission_no in enumerate(sub_arr):
+        fb_city = city_arr[row_idx] if city_arr is not None else None
+        fb_state = state_arr[row_idx] if state_arr is not None else None
 
         image_path = _pick_image_for_row(row_idx, submission_no)
 
-        # --- OCR ---
-        ocr_error = False
-        image_missing = image_path is None
-        lines: List[str] = []
-        if not image_missing:
-            try:
-                # Only dump debug for the first few to keep IO low
-                dbg_path = None
-                if DEBUG_DUMP_MAX and row_idx < DEBUG_DUMP_MAX:
-                    dbg_path = (run_dir / "debug_raw" / f"{_normalize_id(submission_no)}.json")
-                lines = run_ocr(image_path, debug_dump_to=dbg_path)
-            except Exception as e:
-                ocr_error = True
-                print(f"[OCR ERROR] row {row_idx+2} ({submission_no}) @ {image_path}: {e}")
-
-        # --- Parse ---
-        amount_spent = parsers.extract_amount_spent(lines) if lines else None
-        store = parsers.extract_store_name(lines) if lines else None
-        # NOTE: extract_store_location ignores participant fallback by design (your latest parser)
-        store_loc = parsers.extract_store_location(lines, fb_city, fb_state) if lines else None
-        products = parsers.extract_products(lines, max_items=3) if lines else []
-
-        # --- Validity ---
-        if image_missing:
-            validity, reason = "INVALID", "Image missing"
-        elif ocr_error:
-            validity, reason = "INVALID", "OCR failed"
-        else:
-            validity, reason = parsers.decide_validity(amount_spent, products, image_missing=False)
-
-        # --- Row dict ---
-        data = {
-            "Amount spent": amount_spent or "",
-            "Validity": validity,
-            "Reason for invalid": reason,
-            "Product purchased 1": products[0][0] if len(products) >= 1 else "",
-            "Amount purchased 1": products[0][1] if len(products) >= 1 else "",
-            "Product purchased 2": products[1][0] if len(products) >= 2 else "",
-            "Amount purchased 2": products[1][1] if len(products) >= 2 else "",
-            "Product purchased 3": products[2][0] if len(products) >= 3 else "",
-            "Amount purchased 3": products[2][1] if len(products) >= 3 else "",
-            "Store": store or "",
-            "Store Location": store_loc or "",
-        }
-        extracted_rows.append(data)
+        # Only dump debug for the first few to keep IO low
+        dbg_path = None
+        if image_path is not None and DEBUG_DUMP_MAX and row_idx < DEBUG_DUMP_MAX:
+            dbg_path = (run_dir / "debug_raw" / f"{_normalize_id(submission_no)}.json")
+        jobs.append((submission_no, fb_city, fb_state, image_path, dbg_path))
+
+    # --- Extract -> OCR -> Parse (pipelined) ---
+    try:
+        cols = _run_pipeline(z, members, jobs)
+    finally:
+        z.close()
 
     # Assemble output
-    df_new = pd.DataFrame(extracted_rows, columns=[
-        "Amount spent", "Validity", "Reason for invalid",
-        "Product purchased 1", "Amount purchased 1",
-        "Product purchased 2", "Amount purchased 2",
-        "Product purchased 3", "Amount purchased 3",
-        "Store", "Store Location"
-    ])
+    df_new = pd.DataFrame(cols, columns=OUTPUT_COLS, copy=False)
     df_out = pd.concat([df_new, df_raw], axis=1)
 
     OUTPUTS_DIR.mkdir(parents=True, exist_ok=True)
     csv_path = OUTPUTS_DIR / f"processed_{ts}.csv"
-    xlsx_path = OUTPUTS_DIR / f"processed_{ts}.xlsx"
     df_out.to_csv(csv_path, index=False, encoding="utf-8")
-    with pd.ExcelWriter(xlsx_path, engine="xlsxwriter") as writer:
-        df_out.to_excel(writer, index=False, sheet_name="Processed")
+    return df_out, csv_path, df_out.head(50).to_dict(orient="records")
+
+@app.post("/process", response_class=HTMLResponse)
+async def process(request: Request,
+                  raw_csv: UploadFile = File(...), images_zip: UploadFile = File(...)):
+    ts = datetime.now().strftime("%Y%m%d_%H%M%S")
+    loop = asyncio.get_running_loop()
+    done = await loop.run_in_executor(None, _process_batch, raw_csv.file, images_zip, ts)
+    if done is None:
+        return HTMLResponse("<h3>CSV missing 'Submission No' column.</h3>", status_code=400)
+    df_out, csv_path, preview_rows = done
 
-    preview_rows = df_out.head(50).to_dict(orient="records")
     return templates.TemplateResponse(
         "results.html",
         {
             "request": request,
             "csv_url": f"/outputs/{csv_path.name}",
-            "xlsx_url": f"/outputs/{xlsx_path.name}",
+            "xlsx_url": f"/xlsx/{csv_path.stem}",
             "row_count": len(df_out),
             "columns": list(df_out.columns),
             "rows": preview_rows
         }
     )
+
+@app.get("/xlsx/{stem}")
+def download_xlsx(stem: str):
+    """
+    XLSX is the slow export, so it is only built when someone asks for it:
+    from the processed CSV on the first download, then served from disk.
+    """
+    if not _RE_OUTPUT_STEM.fullmatch(stem):
+        return HTMLResponse("<h3>Unknown output.</h3>", status_code=404)
+    csv_path = OUTPUTS_DIR / f"{stem}.csv"
+    xlsx_path = OUTPUTS_DIR / f"{stem}.xlsx"
+    with _xlsx_lock:
+        if not xlsx_path.exists():
+            if not csv_path.exists():
+                return HTMLResponse("<h3>Unknown output.</h3>", status_code=404)
+            try:
+                _xlsx_from_csv(csv_path, xlsx_path)
+            except Exception as e:
+                print("[WARN] XLSX export failed:", e)
+                return HTMLResponse(f"<h3>XLSX export failed: {html.escape(str(e))}</h3>", status_code=500)
+    return FileResponse(xlsx_path, media_type=_XLSX_MEDIA_TYPE, filename=xlsx_path.name)
@@ -2,9 +2,17 @@ from pathlib import Path
 from typing import List, Optional, Any, Iterable, Tuple
 import os
 import json
+import hashlib
+from importlib import metadata
 import numpy as np
 from PIL import Image, ImageOps
 
+# Optional fast JSON (pip install orjson); stdlib json otherwise
+try:
+    import orjson  # type: ignore
+except Exception:
+    orjson = None
+
 # IMPORTANT: Import paddle/paddleocr lazily so module import is fast
 _PaddleOCR = None
 _paddle_device = None
@@ -12,18 +20,21 @@ _paddle_device = None
 # -------- Tunables (trade accuracy vs speed) --------
 MAX_OCR_SIDE = 1600   # down from 2200; big speedup with minimal loss for receipts
 JPEG_QUALITY = 85
+OCR_GRAYSCALE = True  # grey + autocontrast: 1/3 the pixels to encode/decode, evens out faded prints
 
 # Batch more text crops per forward pass
 REC_BATCH_NUM = 32
 
-# Threads for CPU math libs (helps on MKL/OpenBLAS)
-os.environ.setdefault("OMP_NUM_THREADS", "4")
-os.environ.setdefault("OPENBLAS_NUM_THREADS", "4")
-os.environ.setdefault("MKL_NUM_THREADS", "4")
-os.environ.setdefault("VECLIB_MAXIMUM_THREADS", "4")
-os.environ.setdefault("NUMEXPR_NUM_THREADS", "4")
+# Threads for CPU math libs (helps on MKL/OpenBLAS); per OCR process
+OCR_CPU_THREADS = 4
+os.environ.setdefault("OMP_NUM_THREADS", str(OCR_CPU_THREADS))
+os.environ.setdefault("OPENBLAS_NUM_THREADS", str(OCR_CPU_THREADS))
+os.environ.setdefault("MKL_NUM_THREADS", str(OCR_CPU_THREADS))
+os.environ.setdefault("VECLIB_MAXIMUM_THREADS", str(OCR_CPU_THREADS))
+os.environ.setdefault("NUMEXPR_NUM_THREADS", str(OCR_CPU_THREADS))
 
 _ocr_instance = None
+_ocr_kwargs: Optional[dict] = None  # the trial_args entry that constructed _ocr_instance
 
 def _try_import_paddle():
     global _PaddleOCR, _paddle_device
@@ -40,7 +51,7 @@ def _get_ocr():
     Disables angle classifier (often not needed on receipts) and reduces det side len.
     Increases rec batch size. Hides logs.
     """
-    global _ocr_instance
+    global _ocr_instance, _ocr_kwargs
     if _ocr_instance is not None:
         return _ocr_instance
 
@@ -61,7 +72,7 @@ def _get_ocr():
             det_limit_type="max",
             det_limit_side_len=1280, # smaller detector input
             rec_batch_num=REC_BATCH_NUM,
-            cpu_threads=4,
+            cpu_threads=OCR_CPU_THREADS,
             use_gpu=use_gpu,
         ),
         dict(
@@ -69,7 +80,7 @@ def _get_ocr():
             use_angle_cls=False,
             show_log=False,
             rec_batch_num=REC_BATCH_NUM,
-            cpu_threads=4,
+            cpu_threads=OCR_CPU_THREADS,
             use_gpu=use_gpu,
         ),
         dict(lang="en", show_log=False, use_angle_cls=False),
@@ -80,6 +91,7 @@ def _get_ocr():
     for kwargs in trial_args:
         try:
             _ocr_instance = _PaddleOCR(**kwargs)
+            _ocr_kwargs = kwargs
             break
         except Exception:
             _ocr_instance = None
@@ -88,33 +100,74 @@ def _get_ocr():
     if _ocr_instance is None:
         # last resort
         _ocr_instance = _PaddleOCR()
+        _ocr_kwargs = {}
 
     return _ocr_instance
 
+def _dist_version(name: str) -> str:
+    try:
+        return metadata.version(name)
+    except Exception:
+        return "unknown"
+
+def ocr_engine_tag() -> str:
+    """
+    Identifies the OCR engine: paddleocr/paddle versions plus the constructor
+    kwargs that actually succeeded. Part of the persistent OCR cache key, so an
+    upgrade or config change never serves stale lines. Loads the model if needed.
+    """
+    _get_ocr()
+    ident = {
+        "paddleocr": _dist_version("paddleocr"),
+        "paddle": getattr(_paddle_device, "__version__", "unknown"),
+        "kwargs": _ocr_kwargs,
+    }
+    return hashlib.sha256(json.dumps(ident, sort_keys=True, default=str).encode("utf-8")).hexdigest()[:12]
+
+def ocr_cache_tag() -> str:
+    """Identifies the image prep settings; part of every cache key derived from OCR input."""
+    return f"s{MAX_OCR_SIDE}" + ("_g" if OCR_GRAYSCALE else "")
+
 def _cached_resized_path(orig: Path) -> Path:
     cache_dir = orig.parent / "_cache"
     cache_dir.mkdir(parents=True, exist_ok=True)
-    return cache_dir / f"{orig.stem}_s{MAX_OCR_SIDE}.jpg"
+    return cache_dir / f"{orig.stem}_{ocr_cache_tag()}.jpg"
 
-def _prepare_image_for_ocr(image_path: Path) -> Path:
+def _prepare_image_for_ocr(image_path: Path) -> np.ndarray:
     """
     Resize long side to MAX_OCR_SIDE (cached). This alone saves a lot of time.
+    Large JPEGs are decoded at reduced scale, so full-size pixels are never materialized.
+    Returns RGB pixels; a freshly prepared image is handed over as-is instead
+    of being re-decoded from the cache file.
     """
     try:
         cached = _cached_resized_path(image_path)
         if cached.exists():
-            return cached
+            with Image.open(cached) as im:
+                return np.array(im.convert("RGB"))
         with Image.open(image_path) as im:
-            im = ImageOps.exif_transpose(im).convert("RGB")
+            w, h = im.size
+            m = max(w, h)
+            if m > MAX_OCR_SIDE:
+                # JPEG only: let libjpeg decode at 1/2, 1/4 or 1/8 scale (never below the target size)
+                scale = MAX_OCR_SIDE / float(m)
+                im.draft("L" if OCR_GRAYSCALE else "RGB", (int(w * scale), int(h * scale)))
+            im = ImageOps.exif_transpose(im).convert("L" if OCR_GRAYSCALE else "RGB")
             w, h = im.size
             m = max(w, h)
             if m > MAX_OCR_SIDE:
                 scale = MAX_OCR_SIDE / float(m)
                 im = im.resize((max(1, int(w * scale)), max(1, int(h * scale))), Image.BILINEAR)
-            im.save(cached, format="JPEG", quality=JPEG_QUALITY, optimize=True)
-        return cached
+            if OCR_GRAYSCALE:
+                im = ImageOps.autocontrast(im)
+            try:
+                im.save(cached, format="JPEG", quality=JPEG_QUALITY, optimize=True)
+            except Exception:
+                pass
+            return np.array(im.convert("RGB"))
     except Exception:
-        return image_path
+        with Image.open(image_path) as im:
+            return np.array(im.convert("RGB"))
 
 def _group_into_lines(items: Iterable[Tuple[float, float, float, float, str]], y_tol=10.0) -> list[str]:
     rows: list[list[Tuple[float, float, float, float, str]]] = []
@@ -208,13 +261,23 @@ def _flatten_text_any(raw: Any) -> list[str]:
     walk(raw)
     return lines
 
+def dump_json_bytes(obj: Any, indent: bool = False) -> bytes:
+    """UTF-8 JSON; numpy arrays/scalars become lists/numbers, anything else str()."""
+    if orjson is not None:
+        opt = orjson.OPT_SERIALIZE_NUMPY | (orjson.OPT_INDENT_2 if indent else 0)
+        try:
+            return orjson.dumps(obj, option=opt, default=str)
+        except TypeError:
+            pass  # e.g. non-str dict keys; let stdlib json coerce them
+    return json.dumps(obj, ensure_ascii=False, indent=2 if indent else None, default=str).encode("utf-8")
+
+def load_json_bytes(data: bytes) -> Any:
+    return orjson.loads(data) if orjson is not None else json.loads(data)
+
 def run_ocr(image_path: Path, debug_dump_to: Optional[Path] = None) -> List[str]:
     ocr = _get_ocr()
-    prepped = _prepare_image_for_ocr(Path(image_path))
-
-    # Read once to numpy (fast path)
-    with Image.open(prepped) as im:
-        arr = np.array(im.convert("RGB"))
+    # Decoded once, straight to numpy (fast path)
+    arr = _prepare_image_for_ocr(Path(image_path))
 
     # Call OCR (cls disabled in config; fewer passes)
     try:
@@ -222,15 +285,14 @@ def run_ocr(image_path: Path, debug_dump_to: Optional[Path] = None) -> List[str]
     except TypeError:
         raw = ocr.ocr(arr)
 
+    lines = _flatten_text_any(raw)
+
     if debug_dump_to:
         try:
             debug_dump_to.parent.mkdir(parents=True, exist_ok=True)
-            with open(debug_dump_to, "w", encoding="utf-8") as f:
-                f.write(json.dumps(raw, ensure_ascii=False, indent=2, default=str))
-            txt_path = debug_dump_to.with_suffix(".txt")
-            with open(txt_path, "w", encoding="utf-8") as f:
-                f.write("\n".join(_flatten_text_any(raw)))
+            debug_dump_to.write_bytes(dump_json_bytes(raw, indent=True))
+            debug_dump_to.with_suffix(".txt").write_bytes("\n".join(lines).encode("utf-8"))
         except Exception:
             pass
 
-    return _flatten_text_any(raw)
+    return lines
@@ -0,0 +1,102 @@
+from concurrent.futures import Future, ProcessPoolExecutor
+from pathlib import Path
+from typing import List, Optional
+import os
+import multiprocessing
+import threading
+
+from importlib import metadata
+
+from .ocr_extractor import run_ocr, _get_ocr, ocr_engine_tag, OCR_CPU_THREADS
+
+# Workers sharing one GPU (each holds its own CUDA context and model copy)
+OCR_GPU_WORKERS = 2
+
+_pool: Optional[ProcessPoolExecutor] = None
+_concurrency: Optional[int] = None
+_engine_tag: Optional[str] = None
+_engine_tag_lock = threading.Lock()
+
+def _init_worker():
+    """
+    Runs once in each worker when it starts: load the model up front so every
+    task reuses the same warm PaddleOCR instance.
+    """
+    try:
+        _get_ocr()
+    except Exception as e:
+        # keep the worker alive; run_ocr will surface the error per row
+        print("[WARN] OCR worker warmup failed:", e)
+
+def _ping() -> bool:
+    return True
+
+def _gpu_build_installed() -> bool:
+    # the CUDA wheel is a separate distribution; checked from its metadata so
+    # the web process never imports paddle itself
+    try:
+        metadata.version("paddlepaddle-gpu")
+        return True
+    except Exception:
+        return False
+
+def concurrency() -> int:
+    """
+    Max OCR calls in flight (one PaddleOCR instance per worker process).
+    OCR_CONCURRENCY from the environment if it is a valid int, else
+    OCR_GPU_WORKERS on a CUDA build, else one worker per OCR_CPU_THREADS cores.
+    """
+    global _concurrency
+    if _concurrency is None:
+        n = None
+        env = os.environ.get("OCR_CONCURRENCY")
+        if env:
+            try:
+                n = int(env)
+            except ValueError:
+                print(f"[WARN] ignoring invalid OCR_CONCURRENCY={env!r}")
+        if n is None:
+            n = OCR_GPU_WORKERS if _gpu_build_installed() else (os.cpu_count() or 1) // OCR_CPU_THREADS
+        _concurrency = max(1, n)
+    return _concurrency
+
+def get_pool() -> ProcessPoolExecutor:
+    """
+    Lazily created, reused across requests for the life of the app.
+    Uses 'spawn' so workers never inherit a forked copy of Paddle's thread pools.
+    """
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(
+            max_workers=concurrency(),
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+        )
+    return _pool
+
+def warmup():
+    """
+    Start the workers before the first upload. The first worker initializes
+    alone so a missing model is downloaded once, not by every worker at once.
+    The second batch is a full concurrency(): the first worker is idle by then
+    and takes one ping without spawning, so N-1 would leave one worker cold.
+    """
+    global _engine_tag
+    pool = get_pool()
+    try:
+        _engine_tag = pool.submit(ocr_engine_tag).result()
+        for f in [pool.submit(_ping) for _ in range(concurrency())]:
+            f.result()
+    except Exception as e:
+        print("[WARN] OCR warmup failed:", e)
+
+def engine_tag() -> str:
+    """The workers' ocr_engine_tag (asked once; raises while the model can't load)."""
+    global _engine_tag
+    with _engine_tag_lock:
+        if _engine_tag is None:
+            _engine_tag = get_pool().submit(ocr_engine_tag).result()
+        return _engine_tag
+
+def submit(image_path: Path, debug_dump_to: Optional[Path] = None) -> "Future[List[str]]":
+    return get_pool().submit(run_ocr, image_path, debug_dump_to)
@@ -1,7 +1,15 @@
 # parsers.py
 import re
 import difflib
-from typing import List, Tuple, Optional, Any
+from collections import Counter
+from functools import lru_cache
+from typing import List, Tuple, Optional, Any, Dict, Iterable, Iterator
+
+# Optional multi-pattern matcher (pip install pyahocorasick); plain substring scans otherwise
+try:
+    import ahocorasick  # type: ignore
+except Exception:
+    ahocorasick = None
 
 # ---------------------------------
 # OPTIONAL curated lists (auto-load)
@@ -70,10 +78,12 @@ _NUM = r"(?:\d{1,3}(?:,\d{3})*(?:\.\d{2})|\d+(?:\.\d{2})?)"
 _CCY = r"(?:RM|MYR|R\s*M)"
 _SEP = r"[:=\-\s]*"
 
+# alternatives grouped by first word so they share the prefix match; order within a
+# group is the original priority (and bare "total" still needs a word boundary)
 KW_TOTAL = (
-    r"(?:grand\s*total|total\s*amount|total\s*payable|total\s*price|"
-    r"net\s*amount|net\s*total|amount\s*due|amount\s*payable|balance\s*due|"
-    r"total\s*after\s*discount|total\b)"
+    r"(?:grand\s*total|"
+    r"total(?:\s*(?:amount|payable|price|after\s*discount)|\b)|"
+    r"net\s*(?:amount|total)|amount\s*(?:due|payable)|balance\s*due)"
 )
 
 RE_KW_LEFT = re.compile(rf"{KW_TOTAL}{_SEP}{_CCY}?\s*({_NUM})\b", re.I)
@@ -83,33 +93,46 @@ RE_ANY_NUM = re.compile(rf"({_NUM})")
 RE_JUST_KW = re.compile(KW_TOTAL, re.I)
 
 PRODUCT_CODE_RE = re.compile(r"(?<![A-Z0-9])([A-Z]{2,}[A-Z0-9\-]{1,})(?![A-Z0-9])")
+_PRODUCT_CODE_SEARCH = PRODUCT_CODE_RE.search  # bound once: hot per-line calls skip the attribute lookup
 
+# exactly one group takes part in any match (m.lastindex); "2x" and "2 pcs" share
+# their digit-first branch, "x" still tried before the unit words
 QTY_RE = re.compile(
-    r"\b(?:QTY|QTY:|QTY\.|QTY=|QTY\s+)\s*(\d+)\b|\b(\d+)x\b|\bx(\d+)\b|\b(\d+)\s*(?:pcs|unit|units|pcs\.)\b",
+    r"\b(?:QTY|QTY:|QTY\.|QTY=|QTY\s+)\s*(\d+)\b|\b(\d+)(?:x\b|\s*(?:pcs|unit|units|pcs\.)\b)|\bx(\d+)\b",
     re.IGNORECASE
 )
+_QTY_SEARCH = QTY_RE.search
 
+# "RM 1,299.00" / "MYR149" (ccy + ccyval) or a bare "1,299.00" not glued to letters (dec)
 PRICE_TOKEN_RE = re.compile(
-    r"""
-    (?:
-        (?P<ccy>RM|MYR|R\s*M)\s*
-        (?P<ccyval>\d{1,3}(?:,\d{3})*(?:\.\d{2})?|\d+\.\d{2})
-    )
-    |
-    (?:
-        (?<![A-Za-z])(?P<dec>\d{1,3}(?:,\d{3})*\.\d{2})(?![A-Za-z])
-    )
-    """,
-    re.IGNORECASE | re.VERBOSE
+    r"(?:(?P<ccy>RM|MYR|R\s*M)\s*(?P<ccyval>\d{1,3}(?:,\d{3})*(?:\.\d{2})?|\d+\.\d{2}))"
+    r"|(?:(?<![A-Za-z])(?P<dec>\d{1,3}(?:,\d{3})*\.\d{2})(?![A-Za-z]))",
+    re.IGNORECASE
 )
 
+@lru_cache(maxsize=4096)
+def _line_qty(ln: str) -> int:
+    """
+    Quantity on a line (default 1). Cached: the same line is asked for by several
+    product matchers (and once per matching hint).
+    """
+    q = _QTY_SEARCH(ln)
+    return int(q.group(q.lastindex)) if q else 1
+
 _QTY_WORDS_RE = re.compile(r"\b(qty|unit|units|pcs|pcs\.|piece|pieces|x\d+|\d+x)\b", re.I)
+_QTY_WORDS_SEARCH = _QTY_WORDS_RE.search
 
 def _to_float(s: str) -> float:
+    # str.replace beats a translate table here (single char, usually absent: returns s as-is)
     return float(s.replace(",", ""))
 
+_NON_AMOUNT_RE = re.compile(r"[^\d.,]")
+# ASCII fast path: delete everything but digits . , in one pass (\d also keeps non-ASCII digits: regex for those)
+_NON_AMOUNT_TBL = str.maketrans("", "", "".join(chr(c) for c in range(128) if chr(c) not in "0123456789.,"))
+
 def _normalize_amount(val: str) -> Optional[str]:
-    raw = re.sub(r"[^\d.,]", "", val or "")
+    val = val or ""
+    raw = val.translate(_NON_AMOUNT_TBL) if val.isascii() else _NON_AMOUNT_RE.sub("", val)
     if not raw:
         return None
     if raw.count(".") >= 1 and raw.rsplit(".", 1)[-1].isdigit():
@@ -123,36 +146,129 @@ def _normalize_amount(val: str) -> Optional[str]:
     except Exception:
         return None
 
-def _contains_store_hint(text: str) -> bool:
-    up = text.upper()
+def _build_automaton(needles: List[str]) -> Any:
+    """
+    One Aho-Corasick automaton over all needles: a single O(len(text)) scan
+    finds every needle occurring in the text. Value = (first index, needle).
+    Returns None when pyahocorasick is unavailable (or nothing to match).
+    """
+    if ahocorasick is None:
+        return None
+    ac = ahocorasick.Automaton()
+    for i, n in enumerate(needles):
+        if n and n not in ac:
+            ac.add_word(n, (i, n))
+    if len(ac) == 0:
+        return None
+    ac.make_automaton()
+    return ac
+
+# hints are matched as written against the uppercased line (same as the substring scan)
+_STORE_HINTS_AC = _build_automaton(STORE_HINTS)
+
+_HINT_AC_CACHE: Dict[int, Tuple[List[str], Any]] = {}
+_ITEM_AC_CACHE: Dict[int, Tuple[List[str], Any]] = {}
+_ITEM_TABLE_CACHE: Dict[int, Tuple[List[str], Any]] = {}
+_HINT_UP_CACHE: Dict[int, Tuple[List[str], Any]] = {}
+
+def _per_list(cache: Dict[int, Tuple[List[str], Any]], hints: List[str], build) -> Any:
+    """
+    build(hints), computed once per list object (curated lists are module
+    constants, so this is effectively computed once).
+    """
+    hit = cache.get(id(hints))
+    if hit is not None and hit[0] is hints:
+        return hit[1]
+    if len(cache) >= 32:
+        cache.clear()
+    val = build(hints)
+    cache[id(hints)] = (hints, val)
+    return val
+
+def _hint_automaton(hints: List[str]) -> Any:
+    """Automaton over the uppercased hints (None without pyahocorasick)."""
+    if ahocorasick is None:
+        return None
+    return _per_list(_HINT_AC_CACHE, hints, lambda hs: _build_automaton([h.upper() for h in hs]))
+
+def _item_table(items: List[str]) -> List[Optional[Tuple[str, str, str]]]:
+    """Per item: (needle, output name, dedupe key); None for non-str / blank items."""
+    return _per_list(_ITEM_TABLE_CACHE, items, lambda its: [
+        (p.upper(), p.strip(), _clean_for_match(p)) if isinstance(p, str) and p.strip() else None
+        for p in its
+    ])
+
+def _item_automaton(items: List[str]) -> Any:
+    # skipped items become "" (never added), so values index straight into items
+    if ahocorasick is None:
+        return None
+    return _per_list(_ITEM_AC_CACHE, items, lambda its: _build_automaton(
+        [t[0] if t is not None else "" for t in _item_table(its)]
+    ))
+
+def _contains_store_hint(text: str, up: Optional[str] = None) -> bool:
+    if up is None:
+        up = text.upper()
+    if _STORE_HINTS_AC is not None:
+        return next(_STORE_HINTS_AC.iter(up), None) is not None
     return any(h in up for h in STORE_HINTS)
 
+_NORM_SEP_RE = re.compile(r"[\s\W_]+")
+
 def _norm(s: str) -> str:
     s = (s or "").upper()
-    return re.sub(r"[\s\W_]+", " ", s).strip()
+    return _NORM_SEP_RE.sub(" ", s).strip()
 
 # -----------------------------
 # fuzzy canonicalization
 # -----------------------------
 
+_MATCH_JUNK_RE = re.compile(r"[^A-Z0-9\s/.\-]")
+_WS_RE = re.compile(r"\s+")
+
 def _clean_for_match(s: str) -> str:
     s = (s or "").upper()
-    s = re.sub(r"[^A-Z0-9\s/.\-]", " ", s)
-    s = re.sub(r"\s+", " ", s).strip()
+    s = _MATCH_JUNK_RE.sub(" ", s)
+    s = _WS_RE.sub(" ", s).strip()
     return s
 
-def _similarity(a: str, b: str) -> float:
-    return difflib.SequenceMatcher(None, _clean_for_match(a), _clean_for_match(b)).ratio()
+@lru_cache(maxsize=8192)
+def _match_profile(s: str) -> Tuple[str, Dict[str, int]]:
+    """Cleaned form + character counts of a fuzzy-match candidate (curated constants: hit every call)."""
+    c = _clean_for_match(s)
+    return c, Counter(c)
 
 def _best_fuzzy_match(text: str, candidates: List[str], min_score: float) -> Tuple[Optional[str], float]:
+    """
+    Same result as scoring every candidate with SequenceMatcher.ratio() on the
+    _clean_for_match forms, but candidates whose upper bound on the ratio (length,
+    then shared characters: what real_quick_ratio/quick_ratio compute) cannot beat
+    the best so far are skipped.
+    """
     if not text or not candidates:
         return None, 0.0
+    # OCR text varies per call: profiled here, not in the candidate cache
+    ta = _clean_for_match(text)
+    ta_counts = Counter(ta)
+    la = len(ta)
     best = None
     best_score = 0.0
     for cand in candidates:
         if not cand or not isinstance(cand, str):
             continue
-        sc = _similarity(text, cand)
+        cb, cb_counts = _match_profile(cand)
+        total = la + len(cb)
+        if total:
+            if 2.0 * min(la, len(cb)) / total <= best_score:
+                continue
+            shared = 0
+            for ch, n in cb_counts.items():
+                m = ta_counts.get(ch)
+                if m:
+                    shared += n if n < m else m
+            if 2.0 * shared / total <= best_score:
+                continue
+        sc = difflib.SequenceMatcher(None, ta, cb).ratio()
         if sc > best_score:
             best_score = sc
             best = cand
@@ -228,38 +344,56 @@ def _dedupe_products(items: List[Tuple[str, int]]) -> List[Tuple[str, int]]:
 # store name / location
 # -----------------------------
 
-def _match_known_store(lines: List[str], preferred_stores: Optional[List[str]] = None) -> Optional[Tuple[str, str]]:
+# "not passed" for store_match (None is a real result: no store line)
+_UNSET: Any = object()
+
+def find_known_store(lines: List[str], ups: Optional[List[str]] = None) -> Optional[Tuple[str, str]]:
+    """(store_line_text, normalized_key) with the default hints. Callers running both
+    extract_store_name and extract_store_location can compute this once and pass it as store_match."""
+    return _match_known_store(lines, ups=ups)
+
+def _match_known_store(lines: List[str], preferred_stores: Optional[List[str]] = None,
+                       ups: Optional[List[str]] = None) -> Optional[Tuple[str, str]]:
     """
     Try to find a store line using curated store hints (or generic hints),
     and return (store_line_text, normalized_key).
     """
     top = lines[:12]
+    top_ups = ups[:12] if ups is not None else [ln.upper() for ln in top]
 
     # 1) preferred curated list (if available)
     if preferred_stores is None and PREFERRED_STORE_HINTS:
         preferred_stores = PREFERRED_STORE_HINTS
 
     if preferred_stores:
-        pref_up = [s.upper() for s in preferred_stores]
-        for ln in top:
-            up = ln.upper()
-            if any(s in up for s in pref_up):
-                return ln.strip(), _norm(ln)
+        ac = _hint_automaton(preferred_stores)
+        if ac is not None:
+            for ln, up in zip(top, top_ups):
+                if next(ac.iter(up), None) is not None:
+                    return ln.strip(), _norm(ln)
+        else:
+            pref_up = _per_list(_HINT_UP_CACHE, preferred_stores, lambda hs: [h.upper() for h in hs])
+            for ln, up in zip(top, top_ups):
+                if any(h in up for h in pref_up):
+                    return ln.strip(), _norm(ln)
 
     # 2) generic hints
-    for ln in top:
-        if _contains_store_hint(ln):
+    for ln, up in zip(top, top_ups):
+        if _contains_store_hint(ln, up):
             return ln.strip(), _norm(ln)
 
-    # 3) ALLCAPS fallback
-    for ln in top:
-        if ln.strip() and ln.strip().upper() == ln.strip():
-            return ln.strip(), _norm(ln)
-
-    # 4) first non-empty
-    for ln in top:
-        if ln.strip():
-            return ln.strip(), _norm(ln)
+    # 3) ALLCAPS fallback, else 4) first non-empty (one pass, one strip per line)
+    first = None
+    for ln, up in zip(top, top_ups):
+        st = ln.strip()
+        if not st:
+            continue
+        if up.strip() == st:
+            return st, _norm(ln)
+        if first is None:
+            first = (st, ln)
+    if first is not None:
+        return first[0], _norm(first[1])
 
     return None
 
@@ -282,56 +416,73 @@ def _extract_aeon_store_bottom(lines: List[str]) -> Optional[str]:
             return ln
     return aeon_lines[0]
 
-def extract_store_name(lines: List[str], preferred_stores: Optional[List[str]] = None) -> Optional[str]:
-    top_text = " ".join(lines[:10]).upper()
-    if "AEON" in top_text:
+def extract_store_name(lines: List[str], preferred_stores: Optional[List[str]] = None,
+                       ups: Optional[List[str]] = None, store_match: Any = _UNSET) -> Optional[str]:
+    if ups is None:
+        ups = [ln.upper() for ln in lines]
+    if "AEON" in " ".join(ups[:10]):
         bottom_aeon = _extract_aeon_store_bottom(lines)
         if bottom_aeon:
             return _canonicalize_store_name(bottom_aeon)
 
-    m = _match_known_store(lines, preferred_stores)
+    # a precomputed store_match only stands in for the default hints
+    m = store_match if store_match is not _UNSET and preferred_stores is None \
+        else _match_known_store(lines, preferred_stores, ups)
     raw = m[0] if m else None
     return _canonicalize_store_name(raw)
 
 # ---- Receipt-only location helpers + curated map check ----
 
 _POSTCODE_RE = re.compile(r"\b(\d{5})\b")
-_STATE_SET = {s.lower(): s for s in MALAYSIAN_STATES}
+_POSTCODE_SEARCH = _POSTCODE_RE.search
+_SPLIT_LOC_RE = re.compile(r"[,;|-]")
+_NON_ALPHA_RE = re.compile(r"[^A-Za-z\s]")
+# ASCII letter runs of 2+: same tokens as sub(non-alpha -> " ") + split() + len filter, in one pass
+_LETTER_RUN_RE = re.compile(r"[A-Za-z]{2,}")
+_STATE_CANON = {s.lower(): s for s in MALAYSIAN_STATES}  # lowercase key -> canonical casing
+_STATE_KEYS = tuple(_STATE_CANON)
+_STATE_RANK = {k: i for i, k in enumerate(_STATE_KEYS)}
+# any state name anywhere (plain substring, no word boundaries): one scan rejects most lines
+_STATE_RE = re.compile("|".join(sorted(map(re.escape, _STATE_KEYS), key=len, reverse=True)))
+_STATE_SEARCH = _STATE_RE.search
 
 def _extract_city_state_from_line(line: str) -> Optional[str]:
     txt = " ".join(line.replace("|", ",").split())
     low = txt.lower()
-    state_norm = None
-    state_key = None
-    for k, v in _STATE_SET.items():
+    m_state = _STATE_SEARCH(low)
+    if m_state is None:
+        return None
+    # list order decides between several names on one line: only earlier names can still win
+    state_key = m_state.group(0)
+    for k in _STATE_KEYS[:_STATE_RANK[state_key]]:
         if k in low:
-            state_norm = v
             state_key = k
             break
-    if not state_norm:
-        return None
+    state_norm = _STATE_CANON[state_key]
 
-    m_pc = _POSTCODE_RE.search(txt)
+    # only lines naming a state get here; a digit pre-check (any/isdigit, translate)
+    # measured slower than just running this search
+    m_pc = _POSTCODE_SEARCH(txt)
     if m_pc:
         left_right = low.split(state_key, 1)[0]
         after_pc = left_right.split(m_pc.group(1), 1)[-1]
-        city_tokens = re.sub(r"[^A-Za-z\s]", " ", after_pc).split()
-        city_tokens = [t for t in city_tokens if len(t) >= 2]
+        city_tokens = _LETTER_RUN_RE.findall(after_pc)
         if city_tokens:
             city = " ".join(city_tokens).strip().title()
             return f"{city}, {state_norm}"
 
-    parts = [p.strip() for p in re.split(r"[,;|-]", txt) if p.strip()]
+    parts = [p for p in (p.strip() for p in _SPLIT_LOC_RE.split(txt)) if p]
     for i, seg in enumerate(parts):
-        if state_key and state_key in seg.lower():
+        if state_key in seg.lower():
             if i > 0:
-                city = re.sub(r"[^A-Za-z\s]", " ", parts[i - 1]).strip().title()
+                city = _NON_ALPHA_RE.sub(" ", parts[i - 1]).strip().title()
                 if city:
                     return f"{city}, {state_norm}"
             return state_norm
     return state_norm
 
-def extract_store_location(lines: List[str], fallback_city: Optional[str], fallback_state: Optional[str]) -> Optional[str]:
+def extract_store_location(lines: List[str], fallback_city: Optional[str], fallback_state: Optional[str],
+                           ups: Optional[List[str]] = None, store_match: Any = _UNSET) -> Optional[str]:
     """
     Priority:
       1) If we recognized a store and it matches a curated map entry -> return mapped location
@@ -339,7 +490,8 @@ def extract_store_location(lines: List[str], fallback_city: Optional[str], fallb
       3) Never use participant's fallback city/state (by design)
     """
     # 1) curated map by store name
-    store_match = _match_known_store(lines)
+    if store_match is _UNSET:
+        store_match = _match_known_store(lines, ups=ups)
     if store_match and STORE_LOC_MAP:
         _, norm_key = store_match
         if norm_key in STORE_LOC_MAP:
@@ -367,50 +519,72 @@ def extract_store_location(lines: List[str], fallback_city: Optional[str], fallb
 def _price_candidates(line: str) -> List[Tuple[int, float, int]]:
     hits: List[Tuple[int, float, int]] = []
     for m in PRICE_TOKEN_RE.finditer(line):
-        if m.group("ccy"):
-            val = _to_float(m.group("ccyval"))
-            hits.append((m.start("ccyval"), val, 3))
-        elif m.group("dec"):
-            val = _to_float(m.group("dec"))
-            hits.append((m.start("dec"), val, 2))
-    hits.sort(key=lambda x: x[0])
+        # positional: 1=ccy, 2=ccyval, 3=dec (one groups() call, no name lookups)
+        ccy, ccyval, dec = m.groups()
+        if ccy:
+            hits.append((m.start(2), _to_float(ccyval), 3))
+        elif dec:
+            hits.append((m.start(3), _to_float(dec), 2))
+    # finditer yields non-overlapping matches left to right: already sorted by position
     return hits
 
-def _find_khind_rows(lines: List[str]) -> List[Tuple[int, str]]:
-    return [(i, ln) for i, ln in enumerate(lines) if "KHIND" in ln.upper()]
+def _iter_khind_rows(lines: List[str], ups: Optional[List[str]] = None) -> Iterator[Tuple[int, str]]:
+    """Lazy KHIND-row scan: callers that stop early never look at the rest of the receipt."""
+    src = ups if ups is not None else (ln.upper() for ln in lines)
+    for i, up in enumerate(src):
+        if "KHIND" in up:
+            yield i, lines[i]
+
+def find_khind_rows(lines: List[str], ups: Optional[List[str]] = None) -> List[Tuple[int, str]]:
+    """(index, line) of every KHIND row. Callers parsing one receipt several ways can
+    compute this once and pass it as khind_rows."""
+    return list(_iter_khind_rows(lines, ups))
 
 def _looks_like_qty_context(line: str, span_start: int, span_end: int) -> bool:
     left = max(0, span_start - 10)
     right = min(len(line), span_end + 10)
-    return bool(_QTY_WORDS_RE.search(line[left:right]))
+    win = line[left:right]
+    # every _QTY_WORDS_RE alternative needs a q, u, p or x: most windows have none
+    low = win.lower()
+    if "q" not in low and "u" not in low and "p" not in low and "x" not in low:
+        return False
+    return bool(_QTY_WORDS_SEARCH(win))
 
 def _choose_rightmost_best(cands: List[Tuple[int, float, int]], line: str) -> Optional[float]:
     if not cands:
         return None
     best_score = max(s for _, _, s in cands)
-    for pos, val, s in reversed([c for c in cands if c[2] == best_score]):
-        if 2.0 <= val <= 100000.0 and not _looks_like_qty_context(line, pos, pos + 1):
-            return val
+    # rightmost usable candidate of the best tier, else rightmost usable of any tier
+    fallback = None
     for pos, val, s in reversed(cands):
         if 2.0 <= val <= 100000.0 and not _looks_like_qty_context(line, pos, pos + 1):
-            return val
-    return None
+            if s == best_score:
+                return val
+            if fallback is None:
+                fallback = val
+    return fallback
 
 _STOP_AFTER_RE = re.compile(r"\b(total|grand\s*total|balance|remarks?|thank|cash\s*rm?)\b", re.I)
 
-def _khind_line_amount(lines: List[str]) -> Optional[str]:
+def _khind_line_amount(lines: List[str], khind_rows: Optional[Iterable[Tuple[int, str]]] = None) -> Optional[str]:
     LOOKAHEAD = 4
-    for idx, _ln in _find_khind_rows(lines):
+    if khind_rows is None:
+        khind_rows = _iter_khind_rows(lines)
+    # windows of neighbouring KHIND rows overlap: score each line at most once
+    priceless = set()
+    for idx, _ln in khind_rows:
         window_idxs = []
         for j in range(idx, min(len(lines), idx + LOOKAHEAD + 1)):
             if _STOP_AFTER_RE.search(lines[j]):
                 break
             window_idxs.append(j)
         for j in reversed(window_idxs):
-            cands = _price_candidates(lines[j])
-            val = _choose_rightmost_best(cands, lines[j])
+            if j in priceless:
+                continue
+            val = _choose_rightmost_best(_price_candidates(lines[j]), lines[j])
             if val is not None:
                 return f"RM{val:.2f}"
+            priceless.add(j)
     return None
 
 # -----------------------------
@@ -428,12 +602,15 @@ _STOP_ITEM_RE = re.compile(
     re.I
 )
 
+_ALL_NUMERIC_RE = re.compile(r"[\d\s.,\-]+")
+_AEON_QTY_RE = re.compile(r"(\d+)\s*x\b", re.I)
+
 def _looks_like_item_desc(line: str) -> bool:
     if not line or _STOP_ITEM_RE.search(line):
         return False
     up = line.upper().strip()
     # avoid mostly numbers
-    if re.fullmatch(r"[\d\s.,\-]+", up):
+    if _ALL_NUMERIC_RE.fullmatch(up):
         return False
     # avoid bare price tokens like "149.00" alone
     if PRICE_TOKEN_RE.search(line) and len(up.split()) <= 2:
@@ -456,7 +633,7 @@ def _extract_aeon_products(lines: List[str], max_items: int) -> List[Tuple[str,
         ln = lines[i].strip()
         if _ITEM_START_AEON_RE.search(ln) and not _STOP_ITEM_RE.search(ln):
             qty = 1
-            mqty = re.search(r"(\d+)\s*x\b", ln, re.I)
+            mqty = _AEON_QTY_RE.search(ln)
             if mqty:
                 try:
                     qty = int(mqty.group(1))
@@ -493,37 +670,39 @@ def _extract_aeon_products(lines: List[str], max_items: int) -> List[Tuple[str,
 # products
 # -----------------------------
 
-def _match_preferred_items(lines: List[str], preferred_items: List[str], max_items: int) -> List[Tuple[str, int]]:
+def _match_preferred_items(lines: List[str], preferred_items: List[str], max_items: int,
+                           ups: Optional[List[str]] = None) -> List[Tuple[str, int]]:
     out: List[Tuple[str, int]] = []
     seen = set()
-    pref_up = [(p, p.upper()) for p in preferred_items if isinstance(p, str) and p.strip()]
-    if not pref_up:
-        return out
-    for ln in lines:
-        up = ln.upper()
-        for original, needle in pref_up:
-            if needle in up:
-                qty = 1
-                q = QTY_RE.search(ln)
-                if q:
-                    for g in q.groups():
-                        if g and g.isdigit():
-                            qty = int(g)
-                            break
-                key = (_clean_for_match(original), qty)
-                if key in seen:
-                    continue
-                out.append((original.strip(), qty))
-                seen.add(key)
-                if len(out) >= max_items:
-                    return out
+    if ups is None:
+        ups = [ln.upper() for ln in lines]
+    table = _item_table(preferred_items)
+    ac = _item_automaton(preferred_items)
+    for ln, up in zip(lines, ups):
+        if ac is not None:
+            # every item found on the line, visited in list order (same as the scan)
+            hits = [table[i] for i in sorted({i for _end, (i, _n) in ac.iter(up)})]
+        else:
+            hits = [t for t in table if t is not None and t[0] in up]
+        for _needle, name, clean in hits:
+            qty = _line_qty(ln)
+            key = (clean, qty)
+            if key in seen:
+                continue
+            out.append((name, qty))
+            seen.add(key)
+            if len(out) >= max_items:
+                return out
     return out
 
-def extract_products(lines: List[str], max_items: int = 3, preferred_items: Optional[List[str]] = None) -> List[Tuple[str, int]]:
-    top_text = " ".join(lines[:12]).upper()
+def extract_products(lines: List[str], max_items: int = 3, preferred_items: Optional[List[str]] = None,
+                     khind_rows: Optional[Iterable[Tuple[int, str]]] = None,
+                     ups: Optional[List[str]] = None) -> List[Tuple[str, int]]:
+    if ups is None:
+        ups = [ln.upper() for ln in lines]
 
     # AEON: use block parser so 1 receipt item -> 1 product
-    if "AEON" in top_text:
+    if "AEON" in " ".join(ups[:12]):
         aeon_items = _extract_aeon_products(lines, max_items=max_items)
         if aeon_items:
             return aeon_items
@@ -535,20 +714,16 @@ def extract_products(lines: List[str], max_items: int = 3, preferred_items: Opti
 
     # 1) curated preferred item list
     if preferred_items:
-        items.extend(_match_preferred_items(lines, preferred_items, max_items))
+        items.extend(_match_preferred_items(lines, preferred_items, max_items, ups))
         if len(items) >= max_items:
             return _dedupe_products(items)[:max_items]
 
     # 2) KHIND row lines (often contain product model)
-    for _i, ln in _find_khind_rows(lines):
+    if khind_rows is None:
+        khind_rows = _iter_khind_rows(lines, ups)
+    for _i, ln in khind_rows:
         name = ln.strip()
-        qty = 1
-        q = QTY_RE.search(ln)
-        if q:
-            for g in q.groups():
-                if g and g.isdigit():
-                    qty = int(g)
-                    break
+        qty = _line_qty(ln)
         items.append((_canonicalize_product_name(name), qty))
         if len(items) >= max_items:
             return _dedupe_products(items)[:max_items]
@@ -557,17 +732,11 @@ def extract_products(lines: List[str], max_items: int = 3, preferred_items: Opti
     for ln in lines:
         if len(items) >= max_items:
             break
-        m = PRODUCT_CODE_RE.search(ln)
+        m = _PRODUCT_CODE_SEARCH(ln)
         if not m:
             continue
         code = m.group(1).strip("-")
-        qty = 1
-        q = QTY_RE.search(ln)
-        if q:
-            for g in q.groups():
-                if g and g.isdigit():
-                    qty = int(g)
-                    break
+        qty = _line_qty(ln)
         items.append((_canonicalize_product_name(code), qty))
 
     return _dedupe_products(items)[:max_items]
@@ -576,16 +745,26 @@ def extract_products(lines: List[str], max_items: int = 3, preferred_items: Opti
 # amount spent (KHIND row first, totals fallback)
 # -----------------------------
 
-def extract_amount_spent(lines: List[str]) -> Optional[str]:
+def extract_amount_spent(lines: List[str], khind_rows: Optional[Iterable[Tuple[int, str]]] = None,
+                         ups: Optional[List[str]] = None) -> Optional[str]:
     if not lines:
         return None
 
-    amt = _khind_line_amount(lines)
+    if ups is None:
+        ups = [ln.upper() for ln in lines]
+    if khind_rows is None:
+        khind_rows = _iter_khind_rows(lines, ups)
+    amt = _khind_line_amount(lines, khind_rows)
     if amt:
         return amt
 
-    for ln in lines:
-        m = RE_KW_LEFT.search(ln) or RE_KW_RIGHT.search(ln)
+    kw_left, kw_right = RE_KW_LEFT.search, RE_KW_RIGHT.search
+    for ln, up in zip(lines, ups):
+        # every KW_TOTAL alternative contains one of these words: skip both
+        # keyword regexes on the (many) lines that cannot match
+        if "TOTAL" not in up and "AMOUNT" not in up and "BALANCE" not in up:
+            continue
+        m = kw_left(ln) or kw_right(ln)
         if m:
             try:
                 val = _to_float(m.group(1))
@@ -594,29 +773,19 @@ def extract_amount_spent(lines: List[str]) -> Optional[str]:
             except Exception:
                 pass
 
-    cands: List[float] = []
-    for ln in lines:
-        for m in RE_ANY_CCY.finditer(ln):
-            try:
-                cands.append(_to_float(m.group(1)))
-            except Exception:
-                pass
-    if cands:
-        val = max(cands)
-        if 2.0 <= val <= 100000.0:
-            return f"RM{val:.2f}"
-
-    bare: List[float] = []
-    for ln in lines:
-        for m in RE_ANY_NUM.finditer(ln):
-            try:
-                bare.append(_to_float(m.group(1)))
-            except Exception:
-                pass
-    if bare:
-        val = max(bare)
-        if 2.0 <= val <= 100000.0:
-            return f"RM{val:.2f}"
+    # largest currency amount, else largest bare number (running max: no token lists)
+    for rx in (RE_ANY_CCY, RE_ANY_NUM):
+        best: Optional[float] = None
+        for ln in lines:
+            for m in rx.finditer(ln):
+                try:
+                    v = _to_float(m.group(1))
+                except Exception:
+                    continue
+                if best is None or v > best:
+                    best = v
+        if best is not None and 2.0 <= best <= 100000.0:
+            return f"RM{best:.2f}"
 
     return None
 
@@ -0,0 +1,86 @@
+import difflib
+
+import pytest
+
+from app import parsers
+
+
+@pytest.mark.parametrize("line, qty", [
+    ("2x KETTLE", 2),
+    ("KETTLE x3", 3),
+    ("3 pcs FAN", 3),
+    ("5 units FAN", 5),
+    ("QTY 2", 2),
+    ("QTY:4 FAN", 4),
+    ("FAN 12", 1),
+    ("x10y", 1),
+])
+def test_line_qty(line, qty):
+    assert parsers._line_qty(line) == qty
+
+
+@pytest.mark.parametrize("line, keyword, value", [
+    ("TOTAL RM 12.00", "TOTAL", "12.00"),
+    ("GRAND TOTAL: 45.90", "GRAND TOTAL", "45.90"),
+    ("Total Amount RM 8.50", "Total Amount", "8.50"),
+    ("Amount Due: RM 99.00", "Amount Due", "99.00"),
+    ("Balance Due 3.00", "Balance Due", "3.00"),
+    ("SUBTOTAL 9.00", "TOTAL", "9.00"),
+])
+def test_total_keyword_left(line, keyword, value):
+    m = parsers.RE_KW_LEFT.search(line)
+    assert m.group(1) == value
+    assert parsers.RE_JUST_KW.search(line).group(0) == keyword
+
+
+def test_total_keyword_right():
+    assert parsers.RE_KW_RIGHT.search("NET TOTAL 30.00 RM").group(1) == "30.00"
+
+
+@pytest.mark.parametrize("line", ["TOTALRM 12.00", "totally 5.00"])
+def test_bare_total_needs_word_boundary(line):
+    assert parsers.RE_JUST_KW.search(line) is None
+    assert parsers.RE_KW_LEFT.search(line) is None
+
+
+def test_glued_total_falls_back_to_currency_amount():
+    assert parsers.extract_amount_spent(["TOTALRM 12.00"]) == "RM12.00"
+
+
+@pytest.mark.parametrize("line, loc", [
+    # list order decides: "Kuala Lumpur" comes before "WP Kuala Lumpur"
+    ("50450 KUALA LUMPUR, WP KUALA LUMPUR", "Kuala Lumpur"),
+    ("WP Kuala Lumpur 50000", "Wp, Kuala Lumpur"),
+    ("Melaka Penang", "Melaka"),
+    ("81300 Skudai Johor", "Skudai, Johor"),
+    ("Jalan X, Petaling Jaya, Selangor", "Petaling Jaya, Selangor"),
+    ("Shah Alam - Selangor", "Shah Alam, Selangor"),
+    ("No state on this line", None),
+])
+def test_city_state_from_line(line, loc):
+    assert parsers._extract_city_state_from_line(line) == loc
+
+
+def _unpruned_best(text, candidates, min_score):
+    best, best_score = None, 0.0
+    ta = parsers._clean_for_match(text)
+    for cand in candidates:
+        if not cand or not isinstance(cand, str):
+            continue
+        sc = difflib.SequenceMatcher(None, ta, parsers._clean_for_match(cand)).ratio()
+        if sc > best_score:
+            best, best_score = cand, sc
+    return (best, best_score) if best is not None and best_score >= min_score else (None, best_score)
+
+
+@pytest.mark.parametrize("text", [
+    "HARVEY NORMAN", "HARVEYN0RMAN SDN", "AE0N BIG", "SENHENG ELECTRIC (KL)",
+    "JAYA GR0CER", "Kuala Lumpor", "Selangr", "xyz", "",
+])
+@pytest.mark.parametrize("min_score", [0.0, 0.6, 0.9])
+def test_pruned_fuzzy_match_equals_unpruned(text, min_score):
+    candidates = parsers.STORE_HINTS + parsers.MALAYSIAN_STATES + ["", None]
+    if not text:
+        assert parsers._best_fuzzy_match(text, candidates, min_score) == (None, 0.0)
+        return
+    assert parsers._best_fuzzy_match(text, candidates, min_score) == _unpruned_best(text, candidates, min_score)
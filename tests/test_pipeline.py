@@ -0,0 +1,144 @@
+import io
+import threading
+import time
+import zipfile
+from concurrent.futures import Future
+
+import pytest
+
+from app import main, ocr_pool
+
+
+class _Boom(BaseException):
+    pass
+
+
+def _make_zip(images):
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w") as z:
+        for name, data in images.items():
+            z.writestr(name, data)
+    buf.seek(0)
+    return zipfile.ZipFile(buf)
+
+
+def _jobs_for(z, tmp_path, subs):
+    members = main._scan_images(z, tmp_path / "images", main.SUPPORTED_EXT)
+    by_stem = {p.stem: p for p in members}
+    jobs = [(s, None, None, by_stem.get(s), None) for s in subs]
+    return members, jobs
+
+
+@pytest.fixture
+def fake_ocr(monkeypatch, tmp_path):
+    """ocr_pool.submit stub: an image's bytes are its OCR text; b"FAIL" raises."""
+    calls = []
+
+    def submit(image_path, debug_dump_to=None):
+        data = image_path.read_bytes()
+        calls.append(data)
+        fut = Future()
+
+        def finish():
+            time.sleep(0.02 if data.endswith(b"1") else 0)  # finish out of row order
+            if data == b"FAIL":
+                fut.set_exception(RuntimeError("ocr exploded"))
+            else:
+                fut.set_result([data.decode()])
+
+        threading.Thread(target=finish, daemon=True).start()
+        return fut
+
+    monkeypatch.setattr(ocr_pool, "submit", submit)
+    monkeypatch.setattr(ocr_pool, "concurrency", lambda: 3)
+    monkeypatch.setattr(ocr_pool, "engine_tag", lambda: "test")
+    monkeypatch.setattr(main, "OCR_CACHE_DIR", tmp_path / "ocr_cache")
+    return calls
+
+
+def _pipeline_threads():
+    return [t for t in threading.enumerate() if t.name == "zip-extract" or t.name.startswith("ocr-")]
+
+
+def test_rows_come_back_in_row_order(fake_ocr, tmp_path):
+    subs = [f"MLP_{i}" for i in range(1, 13)]
+    z = _make_zip({f"{s}.jpg": f"TOTAL RM {i + 10}.00 #{i}".encode() for i, s in enumerate(subs, 1)})
+    members, jobs = _jobs_for(z, tmp_path, subs)
+    cols = main._run_pipeline(z, members, jobs)
+    assert list(cols["Amount spent"]) == [f"RM{i + 10}.00" for i in range(1, 13)]
+
+
+def test_missing_image_and_ocr_error_mark_only_their_rows(fake_ocr, tmp_path):
+    z = _make_zip({"MLP_1.jpg": b"TOTAL RM 5.00", "MLP_3.jpg": b"FAIL"})
+    members, jobs = _jobs_for(z, tmp_path, ["MLP_1", "MLP_2", "MLP_3"])
+    cols = main._run_pipeline(z, members, jobs)
+    assert cols["Amount spent"][0] == "RM5.00"
+    assert list(cols["Reason for invalid"][1:]) == ["Image missing", "OCR failed"]
+    assert list(cols["Validity"][1:]) == ["INVALID", "INVALID"]
+
+
+def test_duplicate_images_share_one_ocr_call(fake_ocr, tmp_path):
+    subs = ["MLP_1", "MLP_2", "MLP_3"]
+    z = _make_zip({f"{s}.jpg": b"TOTAL RM 7.00" for s in subs})
+    members, jobs = _jobs_for(z, tmp_path, subs)
+    cols = main._run_pipeline(z, members, jobs)
+    assert fake_ocr == [b"TOTAL RM 7.00"]
+    assert list(cols["Amount spent"]) == ["RM7.00"] * 3
+
+
+def test_parse_error_aborts_and_stops_every_stage(fake_ocr, tmp_path, monkeypatch):
+    subs = [f"MLP_{i}" for i in range(1, 80)]
+    z = _make_zip({f"{s}.jpg": f"TOTAL RM {i}.00".encode() for i, s in enumerate(subs, 1)})
+    members, jobs = _jobs_for(z, tmp_path, subs)
+    real_parse = main._parse_row
+
+    def parse(row_idx, job, res):
+        if row_idx == 2:
+            raise ValueError("bad row")
+        return real_parse(row_idx, job, res)
+
+    monkeypatch.setattr(main, "_parse_row", parse)
+    with pytest.raises(ValueError, match="bad row"):
+        main._run_pipeline(z, members, jobs)
+    assert _pipeline_threads() == []
+    assert len(fake_ocr) < len(subs)
+
+
+def test_ocr_stage_crash_fails_the_batch_instead_of_hanging(fake_ocr, tmp_path, monkeypatch):
+    subs = [f"MLP_{i}" for i in range(1, 80)]
+    z = _make_zip({f"{s}.jpg": f"TOTAL RM {i}.00".encode() for i, s in enumerate(subs, 1)})
+    members, jobs = _jobs_for(z, tmp_path, subs)
+
+    def crash(*args):
+        raise _Boom()
+
+    monkeypatch.setattr(main, "_load_ocr_cache", crash)
+    with pytest.raises(_Boom):
+        main._run_pipeline(z, members, jobs)
+    assert _pipeline_threads() == []
+
+
+def test_malformed_cache_entry_is_a_miss(fake_ocr, tmp_path):
+    z = _make_zip({"MLP_1.jpg": b"TOTAL RM 5.00"})
+    members, jobs = _jobs_for(z, tmp_path, ["MLP_1"])
+    main._run_pipeline(z, members, jobs)
+    (cache_file,) = (tmp_path / "ocr_cache").iterdir()
+    cache_file.write_bytes(b'{"not": "a list"}')
+
+    cols = main._run_pipeline(z, members, jobs)
+    assert cols["Amount spent"][0] == "RM5.00"
+    assert len(fake_ocr) == 2
+
+
+def test_batch_runs_uncached_when_engine_tag_fails(fake_ocr, tmp_path, monkeypatch):
+    def no_tag():
+        raise RuntimeError("model failed to load")
+
+    monkeypatch.setattr(ocr_pool, "engine_tag", no_tag)
+    subs = ["MLP_1", "MLP_2"]
+    z = _make_zip({f"{s}.jpg": b"TOTAL RM 7.00" for s in subs})
+    members, jobs = _jobs_for(z, tmp_path, subs)
+    cols = main._run_pipeline(z, members, jobs)
+    assert list(cols["Amount spent"]) == ["RM7.00"] * 2
+    assert fake_ocr == [b"TOTAL RM 7.00"]
+    assert not (tmp_path / "ocr_cache").exists()
@@ -0,0 +1,16 @@
+from app.main import _read_raw_csv
+
+
+def test_passthrough_columns_round_trip_unchanged(tmp_path):
+    src = (
+        "Submission No,Date,Time,Amount\n"
+        "MLP_1,2024-01-05,2024-01-05T10:00:00+08:00,007\n"
+        "MLP_2,,,\n"
+    )
+    path = tmp_path / "raw.csv"
+    path.write_text(src, encoding="utf-8")
+    with open(path, "rb") as f:
+        df = _read_raw_csv(f)
+    out = tmp_path / "out.csv"
+    df.to_csv(out, index=False, lineterminator="\n")
+    assert out.read_text(encoding="utf-8") == src